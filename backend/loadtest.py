@@ -0,0 +1,548 @@
+"""
+End-to-end load test for the SmartRAG API.
+
+Drives the real `main.app` with concurrent signup, login, upload, query,
+documents and history traffic, against a local Postgres database and a
+fake LLM (Groq is never called). The app is served either in-process
+through an ASGI transport or by a uvicorn server on a background thread.
+
+For every concurrency level in the sweep it reports throughput, error
+rate (broken down by status code or exception) and p50/p95/p99 latency
+per endpoint, with queries split by the corpus size of the user asking.
+Event-loop lag of the loop the app runs on is reported overall and per
+endpoint, counting each lag sample against the endpoints that had a
+request in flight while it was taken. In-process, the load generator
+shares the app's loop, so use uvicorn mode for cleaner lag numbers.
+
+Each worker queries as a user with a fixed seeded corpus; measured
+uploads go to a separate scratch user so corpora don't grow mid-sweep.
+Uploaded files go to a temporary directory that is removed afterwards,
+but users, documents, chunks and chat history stay in the target
+database — point it at a throwaway one.
+
+Usage:
+    pip install -r requirements-loadtest.txt
+    python loadtest.py --database-url postgresql://localhost/smartrag_loadtest \\
+        --mode uvicorn --concurrency 1,4,16,32 --duration 30 \\
+        --mix query=6,upload=1,documents=1,history=1,signup=0.5,login=0.5 \\
+        --corpus-sizes 1,5,20 --output results.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+
+DEFAULT_DATABASE_URL = "postgresql://localhost:5432/smartrag_loadtest"
+DEFAULT_MIX = "query=6,upload=1,documents=1,history=1,signup=0.5,login=0.5"
+OPERATIONS = ("signup", "login", "upload", "query", "documents", "history")
+
+VOCABULARY = (
+    "revenue margin forecast quarter growth customer contract renewal policy "
+    "security audit compliance incident latency throughput storage network "
+    "budget hiring roadmap release feature migration database index cache "
+    "training model dataset evaluation accuracy recall precision deployment "
+    "invoice payment refund warranty supplier logistics inventory shipment "
+    "patient dosage clinical trial outcome protocol consent regulation report"
+).split()
+
+
+# ─── APP SETUP ──────────────────────────────────────
+
+def load_app(database_url: str, llm_latency: float, upload_dir: str):
+    """
+    Import `main` against the given database and swap in a fake LLM.
+    DATABASE_URL must be set before import because `database` connects
+    and creates its tables at import time. The import also creates
+    `uploads/` in the working directory, so it runs inside `upload_dir`.
+    """
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("GROQ_API_KEY", "loadtest")
+
+    cwd = os.getcwd()
+    os.chdir(upload_dir)
+    try:
+        import main
+    finally:
+        os.chdir(cwd)
+
+    def fake_generate_answer(query: str, chunks: list) -> str:
+        # The real client blocks its worker thread, so the fake does too.
+        time.sleep(llm_latency)
+        return f"Fake answer to '{query}' from {len(chunks)} chunks."
+
+    main.generate_answer = fake_generate_answer
+    main.UPLOAD_DIR = upload_dir
+    return main.app
+
+
+def make_pdf(rng: random.Random, pages: int, words_per_page: int) -> bytes:
+    """Build a small PDF of random vocabulary text with a unique marker."""
+    import fitz  # PyMuPDF
+
+    doc = fitz.open()
+    marker = uuid.uuid4().hex
+    for page_no in range(pages):
+        words = rng.choices(VOCABULARY, k=words_per_page)
+        text = f"{marker} page {page_no} " + " ".join(words)
+        page = doc.new_page()
+        # A negative result means the text didn't fit and nothing was written.
+        if page.insert_textbox(page.rect + (36, 36, -36, -36), text, fontsize=7) < 0:
+            doc.close()
+            raise ValueError(f"--words-per-page {words_per_page} does not fit on one PDF page; lower it.")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def make_question(rng: random.Random) -> str:
+    return "What does the document say about " + " and ".join(rng.sample(VOCABULARY, 2)) + "?"
+
+
+# ─── METRICS ────────────────────────────────────────
+
+class LagProbe:
+    """
+    Measures how late the event loop wakes a sleeping coroutine, and which
+    endpoints had requests in flight during each sample.
+    """
+
+    def __init__(self, interval: float, active_endpoints):
+        self.interval = interval
+        self.active_endpoints = active_endpoints
+        self.samples = []
+        self.tags = []
+        self.running = True
+
+    async def run(self):
+        while self.running:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - start - self.interval))
+            self.tags.append(self.active_endpoints())
+
+
+class Recorder:
+    """Collects per-endpoint latencies and outcomes for one concurrency level."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.outcomes = {}
+        self.errors = {}
+
+    def record(self, endpoint: str, latency: float, outcome):
+        """`outcome` is the HTTP status code, or the exception class name."""
+        self.latencies.setdefault(endpoint, []).append(latency)
+        counts = self.outcomes.setdefault(endpoint, {})
+        counts[str(outcome)] = counts.get(str(outcome), 0) + 1
+        if not is_success(outcome):
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+
+def is_success(outcome) -> bool:
+    return isinstance(outcome, int) and outcome < 400
+
+
+def percentiles_ms(values: list) -> dict:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "p50": round(p50 * 1000, 2),
+        "p95": round(p95 * 1000, 2),
+        "p99": round(p99 * 1000, 2),
+        "max": round(max(values) * 1000, 2)
+    }
+
+
+def lag_by_endpoint(samples: list, tags: list) -> dict:
+    """Lag percentiles over the samples taken while each endpoint was in flight."""
+    grouped = {}
+    for lag, endpoints in zip(samples, tags):
+        for endpoint in endpoints or ("(idle)",):
+            grouped.setdefault(endpoint, []).append(lag)
+    return {
+        endpoint: {"samples": len(lags), **percentiles_ms(lags)}
+        for endpoint, lags in sorted(grouped.items())
+    }
+
+
+def summarize(recorder: Recorder, elapsed: float, lag_samples: list, lag_tags: list = ()) -> dict:
+    endpoints = {}
+    for endpoint, latencies in sorted(recorder.latencies.items()):
+        count = len(latencies)
+        errors = recorder.errors.get(endpoint, 0)
+        endpoints[endpoint] = {
+            "count": count,
+            "errors": errors,
+            "error_rate": round(errors / count, 4),
+            "throughput": round(count / elapsed, 2),
+            "ok_throughput": round((count - errors) / elapsed, 2),
+            "outcomes": dict(sorted(recorder.outcomes.get(endpoint, {}).items())),
+            **percentiles_ms(latencies)
+        }
+
+    total = sum(e["count"] for e in endpoints.values())
+    total_errors = sum(e["errors"] for e in endpoints.values())
+    return {
+        "elapsed": round(elapsed, 2),
+        "requests": total,
+        "throughput": round(total / elapsed, 2),
+        "ok_throughput": round((total - total_errors) / elapsed, 2),
+        "error_rate": round(total_errors / total, 4) if total else 0.0,
+        "loop_lag_ms": percentiles_ms(lag_samples),
+        "loop_lag_by_endpoint_ms": lag_by_endpoint(lag_samples, lag_tags),
+        "endpoints": endpoints
+    }
+
+
+# ─── TRAFFIC ────────────────────────────────────────
+
+class VirtualUser:
+    def __init__(self, email: str, password: str, corpus_size: int):
+        self.email = email
+        self.password = password
+        self.corpus_size = corpus_size
+        self.token = None
+        self.scratch = None  # Receives measured uploads, keeping the corpus fixed.
+
+    @property
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+class Traffic:
+    """The operations a virtual user can perform, each timing one request."""
+
+    def __init__(self, client, args, run_id: str):
+        self.client = client
+        self.args = args
+        self.run_id = run_id
+        self.signups = 0
+        self.in_flight = {}
+        self.finished = set()
+
+    def new_email(self) -> str:
+        self.signups += 1
+        return f"loadtest-{self.run_id}-{self.signups}@example.com"
+
+    def active_endpoints(self) -> frozenset:
+        """
+        Endpoints in flight now or finished since the last call. The latter
+        matters in-process, where a request that blocks the loop completes
+        before the probe gets to wake up.
+        """
+        # Called from the server thread in uvicorn mode; copy() is atomic.
+        finished, self.finished = self.finished, set()
+        return frozenset(finished.union(e for e, n in self.in_flight.copy().items() if n))
+
+    async def request(self, recorder, endpoint: str, method: str, path: str, **kwargs):
+        self.in_flight[endpoint] = self.in_flight.get(endpoint, 0) + 1
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, **kwargs)
+            outcome = response.status_code
+        except Exception as e:
+            response, outcome = None, type(e).__name__
+        finally:
+            self.in_flight[endpoint] -= 1
+            self.finished.add(endpoint)
+        if recorder is not None:
+            recorder.record(endpoint, time.perf_counter() - start, outcome)
+        return response if is_success(outcome) else None
+
+    async def register(self, user: VirtualUser, recorder=None):
+        body = {"email": user.email, "password": user.password}
+        response = await self.request(recorder, "POST /auth/signup", "POST", "/auth/signup", json=body)
+        if response is not None:
+            user.token = response.json()["token"]
+        return response
+
+    async def signup(self, user: VirtualUser, rng, recorder=None):
+        """Register a fresh account; the caller keeps acting as `user`."""
+        await self.register(VirtualUser(self.new_email(), "loadtest-password", 0), recorder)
+
+    async def login(self, user: VirtualUser, rng, recorder=None):
+        body = {"email": user.email, "password": user.password}
+        response = await self.request(recorder, "POST /auth/login", "POST", "/auth/login", json=body)
+        if response is not None:
+            user.token = response.json()["token"]
+
+    async def upload(self, user: VirtualUser, rng, recorder=None):
+        # Built off-loop so in-process runs don't charge it to the app's loop lag.
+        pdf = await asyncio.to_thread(make_pdf, rng, self.args.pages_per_doc, self.args.words_per_page)
+        files = {"file": (f"loadtest-{uuid.uuid4().hex}.pdf", pdf, "application/pdf")}
+        target = user.scratch or user
+        return await self.request(recorder, "POST /upload", "POST", "/upload", files=files, headers=target.headers)
+
+    async def query(self, user: VirtualUser, rng, recorder=None):
+        body = {"question": make_question(rng), "use_llm": rng.random() < self.args.llm_ratio}
+        endpoint = f"POST /query [corpus={user.corpus_size}]"
+        return await self.request(recorder, endpoint, "POST", "/query", json=body, headers=user.headers)
+
+    async def documents(self, user: VirtualUser, rng, recorder=None):
+        await self.request(recorder, "GET /documents", "GET", "/documents", headers=user.headers)
+
+    async def history(self, user: VirtualUser, rng, recorder=None):
+        await self.request(recorder, "GET /history", "GET", "/history", headers=user.headers)
+
+
+def parse_mix(spec: str) -> dict:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation in mix: {name}")
+        try:
+            mix[name] = float(weight or 1)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid weight for {name}: {weight}")
+        if mix[name] < 0:
+            raise argparse.ArgumentTypeError(f"Weight for {name} must not be negative.")
+    if not any(w > 0 for w in mix.values()):
+        raise argparse.ArgumentTypeError("Traffic mix needs at least one positive weight.")
+    return mix
+
+
+def parse_ints(spec: str, minimum: int = 1) -> list:
+    try:
+        values = [int(v) for v in spec.split(",") if v.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected comma-separated integers, got: {spec}")
+    if not values:
+        raise argparse.ArgumentTypeError("Expected at least one value.")
+    if min(values) < minimum:
+        raise argparse.ArgumentTypeError(f"Values must be at least {minimum}, got: {spec}")
+    return values
+
+
+def parse_positive_int(spec: str) -> int:
+    try:
+        value = int(spec)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected an integer, got: {spec}")
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"Value must be at least 1, got: {spec}")
+    return value
+
+
+async def create_users(traffic: Traffic, count: int, corpus_sizes: list, args) -> list:
+    """Sign up `count` users and their scratch users, and seed each corpus (unmeasured)."""
+    semaphore = asyncio.Semaphore(args.setup_concurrency)
+    users = [
+        VirtualUser(traffic.new_email(), "loadtest-password", corpus_sizes[i % len(corpus_sizes)])
+        for i in range(count)
+    ]
+
+    async def setup(i: int, user: VirtualUser):
+        rng = random.Random(args.seed + i)
+        scratch = VirtualUser(traffic.new_email(), "loadtest-password", 0)
+        async with semaphore:
+            for account in (user, scratch):
+                if await traffic.register(account) is None:
+                    raise RuntimeError(f"Could not create load-test user {account.email}")
+            for _ in range(user.corpus_size):
+                if await traffic.upload(user, rng) is None:
+                    raise RuntimeError(f"Could not seed corpus for {user.email}")
+        # Set only after seeding so that later uploads go to the scratch user.
+        user.scratch = scratch
+
+    await asyncio.gather(*(setup(i, u) for i, u in enumerate(users)))
+    return users
+
+
+async def run_level(traffic: Traffic, users: list, concurrency: int, args, start_probe) -> dict:
+    recorder = Recorder()
+    ops = list(args.mix)
+    weights = [args.mix[op] for op in ops]
+    deadline = time.perf_counter() + args.duration
+
+    async def worker(i: int):
+        user = users[i]
+        rng = random.Random(args.seed * 1000 + concurrency * 100 + i)
+        while time.perf_counter() < deadline:
+            op = rng.choices(ops, weights)[0]
+            await getattr(traffic, op)(user, rng, recorder)
+            if args.think_time:
+                await asyncio.sleep(rng.expovariate(1 / args.think_time))
+
+    # Drop requests finished before this level (setup, warm-up, earlier levels).
+    traffic.active_endpoints()
+    probe = LagProbe(args.lag_interval, traffic.active_endpoints)
+    stop_probe = start_probe(probe)
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    await stop_probe()
+
+    summary = summarize(recorder, elapsed, probe.samples, probe.tags)
+    summary["concurrency"] = concurrency
+    return summary
+
+
+# ─── SERVING ────────────────────────────────────────
+
+def probe_local(probe: LagProbe):
+    """Run the lag probe on the current loop (in-process mode)."""
+    task = asyncio.ensure_future(probe.run())
+
+    async def stop():
+        probe.running = False
+        await task
+
+    return stop
+
+
+def start_uvicorn(app, port: int):
+    """Serve the app from a background thread; return (server, thread, loop)."""
+    import uvicorn
+
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off")
+    server = uvicorn.Server(config)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_until_complete, args=(server.serve(),), daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("uvicorn failed to start.")
+        time.sleep(0.05)
+    return server, thread, loop
+
+
+def probe_remote(loop):
+    """Run lag probes on the server's loop (uvicorn mode)."""
+    def start(probe: LagProbe):
+        future = asyncio.run_coroutine_threadsafe(probe.run(), loop)
+
+        async def stop():
+            probe.running = False
+            await asyncio.wrap_future(future)
+
+        return stop
+
+    return start
+
+
+# ─── REPORT ─────────────────────────────────────────
+
+def fmt(value) -> str:
+    return "-" if value is None else f"{value:.1f}"
+
+
+def print_level(summary: dict):
+    lag = summary["loop_lag_ms"]
+    print(
+        f"\nconcurrency={summary['concurrency']}  requests={summary['requests']}  "
+        f"throughput={summary['throughput']:.1f} req/s ({summary['ok_throughput']:.1f} ok)  "
+        f"errors={summary['error_rate'] * 100:.1f}%  "
+        f"loop lag p50/p99/max={fmt(lag['p50'])}/{fmt(lag['p99'])}/{fmt(lag['max'])} ms"
+    )
+    print(f"  {'endpoint':<28}{'count':>7}{'err%':>7}{'ok/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}  (ms)")
+    for endpoint, e in summary["endpoints"].items():
+        print(
+            f"  {endpoint:<28}{e['count']:>7}{e['error_rate'] * 100:>7.1f}{e['ok_throughput']:>9.1f}"
+            f"{fmt(e['p50']):>9}{fmt(e['p95']):>9}{fmt(e['p99']):>9}"
+        )
+        if e["errors"]:
+            outcomes = ", ".join(f"{k}: {v}" for k, v in e["outcomes"].items())
+            print(f"    outcomes: {outcomes}")
+
+    print(f"  {'loop lag while in flight':<28}{'samples':>7}{'p50':>9}{'p99':>9}{'max':>9}  (ms)")
+    for endpoint, l in summary["loop_lag_by_endpoint_ms"].items():
+        print(f"  {endpoint:<28}{l['samples']:>7}{fmt(l['p50']):>9}{fmt(l['p99']):>9}{fmt(l['max']):>9}")
+
+
+async def run(args) -> list:
+    import httpx
+
+    # Fail fast on a page size that can't be rendered, before any signups.
+    make_pdf(random.Random(args.seed), 1, args.words_per_page)
+
+    upload_dir = tempfile.mkdtemp(prefix="smartrag-loadtest-")
+    app = load_app(args.database_url, args.llm_latency, upload_dir)
+    run_id = uuid.uuid4().hex[:8]
+    timeout = httpx.Timeout(args.timeout)
+
+    server = None
+    if args.mode == "uvicorn":
+        server, thread, loop = start_uvicorn(app, args.port)
+        client = httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{args.port}", timeout=timeout,
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        )
+        start_probe = probe_remote(loop)
+    else:
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://loadtest", timeout=timeout
+        )
+        start_probe = probe_local
+
+    results = []
+    try:
+        traffic = Traffic(client, args, run_id)
+        print(f"Creating {max(args.concurrency)} users with corpus sizes {args.corpus_sizes}...")
+        users = await create_users(traffic, max(args.concurrency), args.corpus_sizes, args)
+
+        # Load the embedding model before anything is timed.
+        warmup_user = max(users, key=lambda u: u.corpus_size)
+        if await traffic.query(warmup_user, random.Random(args.seed)) is None:
+            raise RuntimeError("Warm-up query failed; check the server logs.")
+
+        for concurrency in args.concurrency:
+            summary = await run_level(traffic, users, concurrency, args, start_probe)
+            print_level(summary)
+            results.append(summary)
+    finally:
+        await client.aclose()
+        if server is not None:
+            server.should_exit = True
+            thread.join(timeout=10)
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the SmartRAG API.")
+    parser.add_argument("--database-url", default=os.environ.get("LOADTEST_DATABASE_URL", DEFAULT_DATABASE_URL),
+                        help="Local Postgres to run against (never the production DATABASE_URL).")
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn"], default="inprocess")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--concurrency", type=parse_ints, default=[1, 4, 16],
+                        help="Comma-separated concurrency levels to sweep.")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per concurrency level.")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help="Comma-separated op=weight pairs.")
+    parser.add_argument("--corpus-sizes", type=parse_ints, default=[1, 5],
+                        help="Documents seeded per user, assigned round-robin.")
+    parser.add_argument("--pages-per-doc", type=parse_positive_int, default=3)
+    parser.add_argument("--words-per-page", type=int, default=300)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Seconds the fake LLM sleeps.")
+    parser.add_argument("--llm-ratio", type=float, default=1.0, help="Fraction of queries with use_llm.")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean pause between requests.")
+    parser.add_argument("--lag-interval", type=float, default=0.01)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--setup-concurrency", type=parse_positive_int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this path.")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args), "levels": results}, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
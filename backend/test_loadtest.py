@@ -0,0 +1,124 @@
+import argparse
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from loadtest import (
+    Recorder, Traffic, VirtualUser, is_success, lag_by_endpoint, parse_ints,
+    parse_mix, parse_positive_int, percentiles_ms, probe_local, run_level,
+    summarize
+)
+
+
+def test_parse_mix_weights():
+    assert parse_mix("query=3,upload,history=0") == {"query": 3.0, "upload": 1.0, "history": 0.0}
+
+
+@pytest.mark.parametrize("spec", ["query=-1,upload=1", "query=0", "bogus=1", "query=x"])
+def test_parse_mix_rejects_bad_specs(spec):
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_mix(spec)
+
+
+def test_parse_ints():
+    assert parse_ints("1, 4,16,") == [1, 4, 16]
+
+
+@pytest.mark.parametrize("spec", ["", ",", "0,4", "-2", "a,b"])
+def test_parse_ints_rejects_bad_specs(spec):
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_ints(spec)
+
+
+def test_parse_positive_int():
+    assert parse_positive_int("3") == 3
+
+
+@pytest.mark.parametrize("spec", ["0", "-1", "x"])
+def test_parse_positive_int_rejects_bad_specs(spec):
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_positive_int(spec)
+
+
+def test_is_success():
+    assert is_success(200)
+    assert not is_success(400)
+    assert not is_success("ReadTimeout")
+
+
+def test_percentiles_ms():
+    result = percentiles_ms([i / 1000 for i in range(1, 101)])
+    assert result["p50"] == pytest.approx(50.5)
+    assert result["p99"] == pytest.approx(99.01)
+    assert result["max"] == 100.0
+    assert percentiles_ms([]) == {"p50": None, "p95": None, "p99": None, "max": None}
+
+
+def test_recorder_tracks_outcomes():
+    recorder = Recorder()
+    recorder.record("GET /history", 0.01, 200)
+    recorder.record("GET /history", 0.02, 500)
+    recorder.record("GET /history", 0.03, "ReadTimeout")
+    assert recorder.latencies["GET /history"] == [0.01, 0.02, 0.03]
+    assert recorder.outcomes["GET /history"] == {"200": 1, "500": 1, "ReadTimeout": 1}
+    assert recorder.errors["GET /history"] == 2
+
+
+def test_lag_by_endpoint():
+    samples = [0.001, 0.050, 0.002]
+    tags = [frozenset(), frozenset({"POST /upload", "GET /history"}), frozenset({"GET /history"})]
+    result = lag_by_endpoint(samples, tags)
+    assert list(result) == ["(idle)", "GET /history", "POST /upload"]
+    assert result["POST /upload"]["samples"] == 1
+    assert result["POST /upload"]["max"] == 50.0
+    assert result["GET /history"]["samples"] == 2
+
+
+def test_summarize():
+    recorder = Recorder()
+    for outcome in (200, 200, 200, 400):
+        recorder.record("POST /query [corpus=5]", 0.1, outcome)
+    recorder.record("GET /documents", 0.2, 200)
+
+    summary = summarize(recorder, 2.0, [0.001, 0.003], [frozenset(), frozenset()])
+    query = summary["endpoints"]["POST /query [corpus=5]"]
+    assert query["count"] == 4
+    assert query["error_rate"] == 0.25
+    assert query["throughput"] == 2.0
+    assert query["ok_throughput"] == 1.5
+    assert query["outcomes"] == {"200": 3, "400": 1}
+    assert summary["requests"] == 5
+    assert summary["ok_throughput"] == 2.0
+    assert summary["error_rate"] == 0.2
+    assert summary["loop_lag_by_endpoint_ms"]["(idle)"]["samples"] == 2
+
+
+def test_summarize_empty():
+    summary = summarize(Recorder(), 1.0, [])
+    assert summary["requests"] == 0
+    assert summary["error_rate"] == 0.0
+    assert summary["endpoints"] == {}
+
+
+class FakeClient:
+    async def request(self, method, path, **kwargs):
+        await asyncio.sleep(0.001)
+        return SimpleNamespace(status_code=200)
+
+
+def test_run_level_ignores_requests_finished_before_it():
+    args = SimpleNamespace(
+        mix={"documents": 1.0}, duration=0.05, seed=0, think_time=0.0, lag_interval=0.005
+    )
+    user = VirtualUser("a@example.com", "pw", 1)
+
+    async def scenario():
+        traffic = Traffic(FakeClient(), args, "test")
+        await traffic.request(None, "POST /upload", "POST", "/upload")
+        return await run_level(traffic, [user], 1, args, probe_local)
+
+    summary = asyncio.run(scenario())
+    assert list(summary["endpoints"]) == ["GET /documents"]
+    assert "POST /upload" not in summary["loop_lag_by_endpoint_ms"]
+    assert "GET /documents" in summary["loop_lag_by_endpoint_ms"]